@@ -1,38 +1,87 @@
 import os
-from fastapi import FastAPI, HTTPException
+import hmac
+import time
+import logging
+import orjson
+from collections import OrderedDict
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, EmailStr, ValidationError, field_validator
+from typing import List, Optional, Type, TypeVar
 from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
 from datetime import datetime, timezone
 
-app = FastAPI()
+# Resolve the database once at startup; db stays None when the module or its config is missing
+_db_error = None
+try:
+    from database import async_db as db
+except ImportError:
+    db = None
+    _db_error = "❌ Database module not found (run enable-database first)"
+except Exception as e:
+    db = None
+    _db_error = f"❌ Error: {str(e)[:50]}"
 
+# Collections bound once so handlers skip the per-request db[...] lookup
+categories_col = db["category"] if db is not None else None
+products_col = db["product"] if db is not None else None
+users_col = db["user"] if db is not None else None
+
+logger = logging.getLogger(__name__)
+
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# Comma-separated list of allowed frontend origins, e.g. "https://shop.example.com,http://localhost:3000"
+CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "*").split(",") if o.strip()]
+
+# No cookies or auth headers are used, so credentials stay off and "*" gets static headers
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
+    allow_origins=CORS_ORIGINS,
+    allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    max_age=86400,
 )
 
 # Pydantic models for requests/responses
 class SignUpRequest(BaseModel):
+    model_config = ConfigDict(extra='ignore', frozen=True)
+
     name: str
     email: EmailStr
     password: str
 
+    @field_validator("password")
+    @classmethod
+    def password_fits_bcrypt(cls, v: str) -> str:
+        # bcrypt only uses the first 72 bytes; longer passwords are truncated or rejected by the library
+        if len(v.encode()) > 72:
+            raise ValueError("Password must be at most 72 bytes")
+        return v
+
 class LoginRequest(BaseModel):
-    email: EmailStr
+    model_config = ConfigDict(extra='ignore', frozen=True)
+
+    # Plain str: an unknown address simply fails the lookup, no need for full email validation
+    email: str
     password: str
 
 class CategoryOut(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+
     name: str
     slug: str
     description: Optional[str] = None
     icon: Optional[str] = None
 
 class ProductOut(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+
     id: str
     title: str
     description: Optional[str] = None
@@ -42,91 +91,191 @@ class ProductOut(BaseModel):
     image_url: Optional[str] = None
 
 
+# Set once the unique user.email index exists; until then signup checks for duplicates itself
+_user_email_index_ready = False
+
+async def _ensure_index(col, keys, **kwargs) -> bool:
+    try:
+        await col.create_index(keys, **kwargs)
+        return True
+    except PyMongoError as e:
+        # Keep serving (e.g. /test) when the database is unreachable or the index can't be built
+        logger.warning("Could not ensure index %s on %s: %s", keys, col.name, e)
+        return False
+
+async def _lowercase_stored_emails():
+    """Lowercase emails stored before signup normalized them, so login can match on one form.
+
+    When several accounts lowercase to the same address, the one that already holds it (or else
+    the oldest) gets it; the rest keep their original email and are logged for manual merging.
+    """
+    try:
+        cursor = users_col.find({"email": {"$regex": "[A-Z]"}}, {"_id": 1, "email": 1}).sort("_id", 1)
+        async for u in cursor:
+            email_norm = u["email"].lower()
+            if await users_col.find_one({"email": email_norm}, {"_id": 1}):
+                logger.warning("Not lowercasing email of user %s: %s is already taken", u["_id"], email_norm)
+                continue
+            try:
+                await users_col.update_one({"_id": u["_id"]}, {"$set": {"email": email_norm}})
+            except DuplicateKeyError:
+                logger.warning("Not lowercasing email of user %s: %s is already taken", u["_id"], email_norm)
+    except PyMongoError as e:
+        logger.warning("Could not lowercase stored emails: %s", e)
+
+@app.on_event("startup")
+async def ensure_indexes():
+    global _user_email_index_ready
+    if db is None:
+        return
+    # Unique slug keeps concurrent cold-start seeding idempotent
+    await _ensure_index(categories_col, "slug", unique=True)
+    # Lets list_products filter by category with a bounded index scan
+    await _ensure_index(products_col, [("category", 1), ("_id", 1)])
+    # Must run before the unique email index so it covers the normalized form
+    await _lowercase_stored_emails()
+    # Enforces one account per email and backs the login lookup
+    _user_email_index_ready = await _ensure_index(users_col, "email", unique=True)
+
+
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Hello from FastAPI Backend!"}
 
 @app.get("/api/hello")
-def hello():
+async def hello():
     return {"message": "Hello from the backend API!"}
 
+# Last /test status as (expires_at, response) so frequent probes reuse one check
+STATUS_CACHE_TTL = 10
+_status_cache = (0.0, None)
+
+# Listing collections is a catalog scan, so /test only does it for callers sending this token
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN")
+
+def _debug_authorized(token: Optional[str]) -> bool:
+    if not DEBUG_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode())
+
 @app.get("/test")
-def test_database():
+async def test_database(x_debug_token: Optional[str] = Header(None)):
     """Test endpoint to check if database is available and accessible"""
-    response = {
-        "backend": "✅ Running",
-        "database": "❌ Not Available",
-        "database_url": None,
-        "database_name": None,
-        "connection_status": "Not Connected",
-        "collections": []
-    }
-    
-    try:
-        # Try to import database module
-        from database import db
-        
+    global _status_cache
+    expires_at, response = _status_cache
+    if response is None or expires_at <= time.monotonic():
+        response = {
+            "backend": "✅ Running",
+            "database": "❌ Not Available",
+            "database_url": None,
+            "database_name": None,
+            "connection_status": "Not Connected",
+            "collections": []
+        }
+
         if db is not None:
             response["database"] = "✅ Available"
             response["database_url"] = "✅ Configured"
             response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
-            
-            # Try to list collections to verify connectivity
+
+            # Ping to verify connectivity
             try:
-                collections = db.list_collection_names()
-                response["collections"] = collections[:10]  # Show first 10 collections
+                await db.command("ping")
                 response["database"] = "✅ Connected & Working"
-            except Exception as e:
+            except PyMongoError as e:
                 response["database"] = f"⚠️  Connected but Error: {str(e)[:50]}"
+        elif _db_error:
+            response["database"] = _db_error
         else:
             response["database"] = "⚠️  Available but not initialized"
-            
-    except ImportError:
-        response["database"] = "❌ Database module not found (run enable-database first)"
-    except Exception as e:
-        response["database"] = f"❌ Error: {str(e)[:50]}"
-    
-    # Check environment variables
-    import os
-    response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-    response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
-    
-    return response
+
+        # Check environment variables
+        response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
+        response["database_name"] = "✅ Set" if os.getenv("DATABASE_NAME") else "❌ Not Set"
+
+        _status_cache = (time.monotonic() + STATUS_CACHE_TTL, response)
+
+    if db is None or not _debug_authorized(x_debug_token):
+        return response
+
+    try:
+        collections = await db.list_collection_names()
+    except PyMongoError:
+        return response
+    return {**response, "collections": collections[:10]}  # Show first 10 collections
+
+# Fetch only the fields the response models expose
+_CATEGORY_PROJECTION = {"_id": 0, "name": 1, "slug": 1, "description": 1, "icon": 1}
+_PRODUCT_PROJECTION = {"_id": 1, "title": 1, "description": 1, "price": 1, "category": 1, "in_stock": 1, "image_url": 1}
+
+# Categories inserted into an empty collection, also served when the database is not configured
+_CATEGORY_SEED = (
+    {"name": "Engine", "slug": "engine", "description": "Performance engine parts", "icon": "Cog"},
+    {"name": "Braking", "slug": "braking", "description": "Pads, rotors, kits", "icon": "Disc3"},
+    {"name": "Suspension", "slug": "suspension", "description": "Coilovers, arms, bushings", "icon": "Wrench"},
+    {"name": "Electronics", "slug": "electronics", "description": "Sensors, ECUs, harnesses", "icon": "Cpu"},
+    {"name": "LED Lighting", "slug": "lighting", "description": "Headlights, strips, kits", "icon": "Lightbulb"},
+    {"name": "Bodywork", "slug": "bodywork", "description": "Aero, trims, panels", "icon": "Zap"},
+)
+
+# Static payloads served when the database is not configured, serialized once at import
+_CATEGORIES_FALLBACK_JSON = orjson.dumps(list(_CATEGORY_SEED))
+_DEMO_PRODUCTS = [
+    {"id": "1", "title": "Carbon Intake Kit", "description": "High-flow carbon fiber intake", "price": 299.99, "category": "engine", "in_stock": True, "image_url": None},
+    {"id": "2", "title": "Drilled Brake Rotors", "description": "Performance rotor pair", "price": 189.5, "category": "braking", "in_stock": True, "image_url": None},
+]
+_DEMO_PRODUCTS_JSON = orjson.dumps(_DEMO_PRODUCTS)
+
+# In-process LRU cache of serialized list responses: key -> (expires_at, body)
+CATEGORIES_CACHE_TTL = int(os.getenv("CATEGORIES_CACHE_TTL", 3600))
+PRODUCTS_CACHE_TTL = int(os.getenv("PRODUCTS_CACHE_TTL", 300))
+_RESPONSE_CACHE_MAX = 1024
+_response_cache = OrderedDict()
+
+def _cached_response(key: str) -> Optional[Response]:
+    entry = _response_cache.get(key)
+    if entry is None or entry[0] < time.monotonic():
+        return None
+    _response_cache.move_to_end(key)
+    return Response(content=entry[1], media_type="application/json")
+
+def _cache_response(key: str, ttl: int, content: list) -> Response:
+    body = orjson.dumps(content)
+    _response_cache.pop(key, None)
+    if len(_response_cache) >= _RESPONSE_CACHE_MAX:
+        # Drop the least recently used entry rather than the whole cache
+        _response_cache.popitem(last=False)
+    _response_cache[key] = (time.monotonic() + ttl, body)
+    return Response(content=body, media_type="application/json")
 
 # Business endpoints
 @app.get("/api/categories", response_model=List[CategoryOut])
-def get_categories():
+async def get_categories():
     """Return default categories if database empty; otherwise read from DB"""
-    try:
-        from database import db, create_document, get_documents
-    except Exception:
+    if db is None:
         # Fallback to static categories if DB not configured
-        return [
-            {"name": "Engine", "slug": "engine", "description": "Performance engine parts"},
-            {"name": "Braking", "slug": "braking", "description": "Pads, rotors, kits"},
-            {"name": "Suspension", "slug": "suspension", "description": "Coilovers, arms, bushings"},
-            {"name": "Electronics", "slug": "electronics", "description": "Sensors, ECUs, harnesses"},
-            {"name": "LED Lighting", "slug": "lighting", "description": "Headlights, strips, kits"},
-            {"name": "Bodywork", "slug": "bodywork", "description": "Aero, trims, panels"},
-        ]
+        return Response(content=_CATEGORIES_FALLBACK_JSON, media_type="application/json")
+
+    cached = _cached_response("categories")
+    if cached is not None:
+        return cached
 
     # If DB is available, ensure seed exists and return
-    existing = list(db["category"].find({}))
+    existing = await categories_col.find({}, _CATEGORY_PROJECTION).to_list(length=None)
     if not existing:
-        seed = [
-            {"name": "Engine", "slug": "engine", "description": "Performance engine parts", "icon": "Cog"},
-            {"name": "Braking", "slug": "braking", "description": "Pads, rotors, kits", "icon": "Disc3"},
-            {"name": "Suspension", "slug": "suspension", "description": "Coilovers, arms, bushings", "icon": "Wrench"},
-            {"name": "Electronics", "slug": "electronics", "description": "Sensors, ECUs, harnesses", "icon": "Cpu"},
-            {"name": "LED Lighting", "slug": "lighting", "description": "Headlights, strips, kits", "icon": "Lightbulb"},
-            {"name": "Bodywork", "slug": "bodywork", "description": "Aero, trims, panels", "icon": "Zap"},
-        ]
-        for s in seed:
-            db["category"].insert_one({**s, "created_at": datetime.now(timezone.utc), "updated_at": datetime.now(timezone.utc)})
-        existing = list(db["category"].find({}))
-
-    return [
+        now = datetime.now(timezone.utc)
+        try:
+            await categories_col.insert_many([{**s, "created_at": now, "updated_at": now} for s in _CATEGORY_SEED], ordered=False)
+        except BulkWriteError as e:
+            # Only tolerate duplicate slugs from a concurrent seed; anything else is a real failure
+            write_errors = e.details.get("writeErrors", [])
+            if e.details.get("writeConcernErrors") or any(err.get("code") != 11000 for err in write_errors):
+                raise
+        existing = await categories_col.find({}, _CATEGORY_PROJECTION).to_list(length=None)
+
+    # Returning the response directly skips response_model revalidation; the model is kept for the OpenAPI schema
+    return _cache_response("categories", CATEGORIES_CACHE_TTL, [
         {
             "name": c.get("name"),
             "slug": c.get("slug"),
@@ -134,38 +283,27 @@ def get_categories():
             "icon": c.get("icon"),
         }
         for c in existing
-    ]
+    ])
 
 @app.get("/api/products", response_model=List[ProductOut])
-def list_products(category: Optional[str] = None, limit: int = 12):
-    try:
-        from database import db
-    except Exception:
+async def list_products(category: Optional[str] = None, limit: int = Query(12, ge=1, le=100)):
+    if db is None:
         # Return demo products if DB not configured
-        demo = [
-            {"_id": "1", "title": "Carbon Intake Kit", "description": "High-flow carbon fiber intake", "price": 299.99, "category": "engine", "in_stock": True, "image_url": None},
-            {"_id": "2", "title": "Drilled Brake Rotors", "description": "Performance rotor pair", "price": 189.5, "category": "braking", "in_stock": True, "image_url": None},
-        ]
-        if category:
-            demo = [d for d in demo if d["category"] == category]
-        return [
-            {
-                "id": d.get("_id"),
-                "title": d.get("title"),
-                "description": d.get("description"),
-                "price": d.get("price"),
-                "category": d.get("category"),
-                "in_stock": d.get("in_stock", True),
-                "image_url": d.get("image_url"),
-            }
-            for d in demo[:limit]
-        ]
+        if category is None and limit >= len(_DEMO_PRODUCTS):
+            return Response(content=_DEMO_PRODUCTS_JSON, media_type="application/json")
+        demo = [d for d in _DEMO_PRODUCTS if not category or d["category"] == category]
+        return ORJSONResponse(demo[:limit])
+
+    cache_key = f"products:{category}:{limit}"
+    cached = _cached_response(cache_key)
+    if cached is not None:
+        return cached
 
     q = {}
     if category:
         q["category"] = category
-    docs = list(db["product"].find(q).limit(limit))
-    return [
+    docs = await products_col.find(q, _PRODUCT_PROJECTION).limit(limit).to_list(length=None)
+    return _cache_response(cache_key, PRODUCTS_CACHE_TTL, [
         {
             "id": str(d.get("_id")),
             "title": d.get("title"),
@@ -176,50 +314,108 @@ def list_products(category: Optional[str] = None, limit: int = 12):
             "image_url": d.get("image_url"),
         }
         for d in docs
-    ]
+    ])
 
-# Simple auth (demo only, not production-ready)
+# Simple auth
+import bcrypt
 from hashlib import sha256
 
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+
 def hash_password(pw: str) -> str:
-    return sha256(pw.encode()).hexdigest()
+    """Return a salted bcrypt hash ("$2b$...") suitable for storing in password_hash"""
+    return bcrypt.hashpw(pw.encode(), bcrypt.gensalt(BCRYPT_ROUNDS)).decode()
+
+def verify_password(pw: str, stored: str) -> bool:
+    """Check a plaintext password against a stored hash in roughly constant time.
+
+    Every path costs one bcrypt check, so the response time doesn't reveal whether an
+    account exists or what kind of hash it has.
+    """
+    if stored and not is_legacy_hash(stored):
+        try:
+            # checkpw compares in constant time
+            return bcrypt.checkpw(pw.encode(), stored.encode())
+        except ValueError:
+            # Malformed hash, or a password over 72 bytes on bcrypt >= 5
+            pass
+    # 72-byte cap so bcrypt >= 5 doesn't raise on long passwords
+    bcrypt.checkpw(pw.encode()[:72], _DUMMY_HASH.encode())
+    if stored and is_legacy_hash(stored):
+        # Unsalted SHA-256 hex digest written before the switch to bcrypt
+        return hmac.compare_digest(sha256(pw.encode()).hexdigest().encode(), stored.encode())
+    return False
+
+def is_legacy_hash(stored: str) -> bool:
+    """True for password hashes that predate bcrypt and should be upgraded on the next login"""
+    return not stored.startswith("$2")
+
+# Checked against on every path without a usable bcrypt hash, so timing doesn't reveal registered accounts
+_DUMMY_HASH = hash_password("dummy-password")
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
 
-@app.post("/api/auth/signup")
-def signup(payload: SignUpRequest):
+async def _parse_body(request: Request, model: Type[ModelT]) -> ModelT:
+    """Validate the raw JSON body in one pass (no json.loads + model_validate), reporting errors like FastAPI does"""
     try:
-        from database import db
-    except Exception:
+        return model.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+        )
+
+def _body_openapi(model: Type[BaseModel]) -> dict:
+    """Document a request body that the handler parses itself"""
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": model.model_json_schema()}}}}
+
+@app.post("/api/auth/signup", openapi_extra=_body_openapi(SignUpRequest))
+async def signup(request: Request):
+    payload = await _parse_body(request, SignUpRequest)
+    if db is None:
         # Accept but not persist if DB not configured
         return {"ok": True, "message": "Signed up (demo mode)", "user": {"name": payload.name, "email": payload.email}}
 
-    existing = db["user"].find_one({"email": payload.email})
-    if existing:
+    email_norm = payload.email.lower()
+    if not _user_email_index_ready and await users_col.find_one({"email": email_norm}, {"_id": 1}):
         raise HTTPException(status_code=400, detail="Email already registered")
-
+    # bcrypt releases the GIL, so hashing in the threadpool keeps the event loop free
+    password_hash = await run_in_threadpool(hash_password, payload.password)
+    now = datetime.now(timezone.utc)
     doc = {
         "name": payload.name,
-        "email": str(payload.email),
-        "password_hash": hash_password(payload.password),
+        "email": email_norm,
+        "password_hash": password_hash,
         "is_active": True,
-        "created_at": datetime.now(timezone.utc),
-        "updated_at": datetime.now(timezone.utc),
+        "created_at": now,
+        "updated_at": now,
     }
-    res = db["user"].insert_one(doc)
+    try:
+        res = await users_col.insert_one(doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
     return {"ok": True, "user_id": str(res.inserted_id)}
 
-@app.post("/api/auth/login")
-def login(payload: LoginRequest):
-    try:
-        from database import db
-    except Exception:
+@app.post("/api/auth/login", openapi_extra=_body_openapi(LoginRequest))
+async def login(request: Request):
+    payload = await _parse_body(request, LoginRequest)
+    if db is None:
         # Demo acceptance
         return {"ok": True, "message": "Logged in (demo mode)", "email": payload.email}
 
-    u = db["user"].find_one({"email": str(payload.email)})
-    if not u:
-        raise HTTPException(status_code=401, detail="Invalid credentials")
-    if u.get("password_hash") != hash_password(payload.password):
+    email_norm = payload.email.strip().lower()
+    u = await users_col.find_one({"email": email_norm}, {"_id": 1, "name": 1, "password_hash": 1})
+    # Unknown users and missing/empty hashes verify against nothing: same cost, always False
+    stored = (u.get("password_hash") if u else None) or ""
+    ok = await run_in_threadpool(verify_password, payload.password, stored)
+    if u is None or not ok:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    # Upgrade a legacy SHA-256 hash now that we have the plaintext (bcrypt can't take over 72 bytes)
+    if is_legacy_hash(u["password_hash"]) and len(payload.password.encode()) <= 72:
+        password_hash = await run_in_threadpool(hash_password, payload.password)
+        await users_col.update_one(
+            {"_id": u["_id"]},
+            {"$set": {"password_hash": password_hash, "updated_at": datetime.now(timezone.utc)}},
+        )
     return {"ok": True, "user_id": str(u.get("_id")), "name": u.get("name")}
 
 
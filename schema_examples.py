@@ -68,8 +68,8 @@ def add_comment_to_post(post_id: str, author_id: str, comment_text: str):
     }
     
     # Add comment to post's comments array
-    from database import db
-    result = db.posts.update_one(
+    from database import get_db
+    result = get_db().posts.update_one(
         {"_id": ObjectId(post_id)},
         {"$push": {"comments": comment}}
     )
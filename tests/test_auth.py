@@ -0,0 +1,77 @@
+"""
+Auth endpoint tests against an in-memory MongoDB (mongomock-motor)
+"""
+
+import asyncio
+import os
+import sys
+from hashlib import sha256
+
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+
+@pytest.fixture
+def users(monkeypatch):
+    db = mongomock_motor.AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(main, "db", db)
+    monkeypatch.setattr(main, "categories_col", db["category"])
+    monkeypatch.setattr(main, "products_col", db["product"])
+    monkeypatch.setattr(main, "users_col", db["user"])
+    return db["user"]
+
+
+def insert_user(users, **doc):
+    asyncio.run(users.insert_one({"name": "Old", **doc}))
+
+
+def test_lowercase_signup_rejected_for_legacy_mixed_case_account(users):
+    insert_user(users, email="Foo@ex.com", password_hash=main.hash_password("pw"))
+
+    with TestClient(main.app) as client:
+        res = client.post("/api/auth/signup", json={"name": "New", "email": "foo@ex.com", "password": "pw2"})
+        assert res.status_code == 400
+
+        for email in ("Foo@ex.com", "foo@ex.com"):
+            res = client.post("/api/auth/login", json={"email": email, "password": "pw"})
+            assert res.status_code == 200
+            assert res.json()["name"] == "Old"
+
+    assert asyncio.run(users.count_documents({})) == 1
+
+
+def test_email_case_collision_keeps_existing_lowercase_owner(users):
+    insert_user(users, email="Foo@ex.com", password_hash=main.hash_password("pw"))
+    insert_user(users, email="foo@ex.com", name="Lower", password_hash=main.hash_password("pw2"))
+
+    with TestClient(main.app) as client:
+        res = client.post("/api/auth/login", json={"email": "FOO@ex.com", "password": "pw2"})
+        assert res.status_code == 200
+        assert res.json()["name"] == "Lower"
+
+    assert asyncio.run(users.find_one({"name": "Old"}))["email"] == "Foo@ex.com"
+
+
+def test_legacy_sha256_hash_logs_in_and_is_upgraded(users):
+    insert_user(users, email="old@ex.com", password_hash=sha256(b"pw").hexdigest())
+
+    with TestClient(main.app) as client:
+        assert client.post("/api/auth/login", json={"email": "old@ex.com", "password": "nope"}).status_code == 401
+        assert client.post("/api/auth/login", json={"email": "old@ex.com", "password": "pw"}).status_code == 200
+
+    stored = asyncio.run(users.find_one({"email": "old@ex.com"}))["password_hash"]
+    assert stored.startswith("$2")
+
+
+@pytest.mark.parametrize("doc", [{}, {"password_hash": ""}])
+def test_missing_hash_never_logs_in(users, doc):
+    insert_user(users, email="nohash@ex.com", **doc)
+
+    with TestClient(main.app) as client:
+        res = client.post("/api/auth/login", json={"email": "nohash@ex.com", "password": "dummy-password"})
+        assert res.status_code == 401